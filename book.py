@@ -23,14 +23,46 @@ import urllib
 import urllib.request
 import shutil
 import logging
+import functools
+import hashlib
+import concurrent.futures
+import importlib.metadata
 # import subprocess
 
 # non-standard dependencies
-import toml
 import pystache
 import markdown
 import colorama
 
+# faster toml parser and writer if available, otherwise fallback to toml
+try:
+    import tomllib # python 3.11+
+except ImportError:
+    tomllib = None
+try:
+    import tomli_w
+except ImportError:
+    tomli_w = None
+if tomllib is None or tomli_w is None:
+    import toml
+toml_loads = tomllib.loads if tomllib is not None else toml.loads
+TomlDecodeError = tomllib.TOMLDecodeError if tomllib is not None else toml.decoder.TomlDecodeError
+toml_dumps = tomli_w.dumps if tomli_w is not None else toml.dumps
+
+# orjson is only used for reading, it can't write the 4 space indentation of the existing book files
+try:
+    import orjson
+    json_loads = orjson.loads
+except ImportError:
+    json_loads = json.loads
+
+# optional C markdown parser, see build --cmark
+try:
+    import cmarkgfm
+    import cmarkgfm.cmark
+except ImportError:
+    cmarkgfm = None
+
 
 ###################################################################################################
 # Global setup
@@ -57,6 +89,16 @@ CHAPTER_INDEX = 'index.md'
 
 TOC_INDEX = 'toc.md'
 
+# rendered markdown from the last build, placed next to the book file
+BUILD_CACHE_FILE = '.book-cache.json'
+
+# bump when run_markdown changes what it generates
+BUILD_CACHE_VERSION = 1
+
+MARKDOWN_EXTENSIONS = ['extra', 'def_list', 'codehilite']
+
+CMARK_EXTENSIONS = ['table', 'strikethrough']
+
 #  special html syntax to hack in toc in a generated page
 TOC_HTML_BODY = '__toc_html_body__'
 
@@ -68,6 +110,10 @@ CHAPTER_JSON_CHAPTERS = 'chapters'
 BOOK_JSON_CHAPTER = 'chapter'
 BOOK_JSON_COPYRIGHT = 'copyright'
 
+CACHE_JSON_KEY = 'key'
+CACHE_JSON_BODIES = 'bodies'
+CACHE_JSON_OUTPUTS = 'outputs'
+
 
 ###################################################################################################
 ###################################################################################################
@@ -84,63 +130,87 @@ def folder_exist(file: str) -> bool:
     return os.path.isdir(file)
 
 
+def list_folder(folder: str) -> typing.Dict[str, os.DirEntry]:
+    '''Name to entry, the entries cache the file type so no extra stat is needed.'''
+    with os.scandir(folder) as entries:
+        return {entry.name: entry for entry in entries}
+
+
 def read_file(path: str) -> str:
     LOG.debug(f'reading {path}')
     with open(path, 'r', encoding='utf-8') as input_file:
         return input_file.read()
 
 
+# a line with only separator chars (and whitespace), including the newline
+re_frontmatter_seperator = re.compile(r'^[^\S\n]*' + re.escape(FRONTMATTER_SEPERATOR_CHAR) + '{' + str(FRONTMATTER_SEPERATOR_MIN_LENGTH) + r',}[^\S\n]*(?:\n|$)', re.MULTILINE)
+
 def read_frontmatter_file(path: str, missing_is_error: bool = True) -> typing.Tuple[typing.Any, str]:
-    has_frontmatter = False
-    first = []
-    second = []
     if not missing_is_error and not file_exist(path):
         return (None, '')
-    with open(path, 'r', encoding='utf-8') as input_file:
-        for line in input_file:
-            if not has_frontmatter:
-                s = line.strip()
-                if len(s) >= FRONTMATTER_SEPERATOR_MIN_LENGTH and len(s) * FRONTMATTER_SEPERATOR_CHAR == s:
-                    has_frontmatter = True
-                else:
-                    first.append(line)
-            else:
-                second.append(line)
-        if has_frontmatter:
-            frontmatter = {}
-            try:
-                frontmatter = toml.loads(''.join(first))
-            except toml.decoder.TomlDecodeError as e:
-                LOG.error(f"Parse error: {path}: {e}")
-            return (frontmatter, ''.join(second))
-        else:
-            return (None, ''.join(first))
+    text = read_file(path)
+    match = re_frontmatter_seperator.search(text)
+    if match is None:
+        return (None, text)
+    frontmatter = {}
+    try:
+        frontmatter = toml_loads(text[:match.start()])
+    except TomlDecodeError as e:
+        LOG.error(f"Parse error: {path}: {e}")
+    return (frontmatter, text[match.end():])
+
+
+def read_markdown_body(path: str) -> str:
+    '''Same content as read_frontmatter_file but skips parsing the frontmatter.'''
+    text = read_file(path)
+    match = re_frontmatter_seperator.search(text)
+    return text if match is None else text[match.end():]
 
 
 def frontmatter_to_string(frontmatter:typing.Optional[typing.Any]) -> str:
     if frontmatter is not None:
-        return toml.dumps(frontmatter).rstrip()
+        return toml_dumps(frontmatter).rstrip()
     else:
         return ''
 
 
 def write_frontmatter_file(path: str, frontmatter:typing.Optional[typing.Any], content:str):
-    LOG.debug(f'Writing {path}')
-    directory = os.path.dirname(path)
-    os.makedirs(directory, exist_ok=True)
-    with open(path, 'w', encoding='utf-8') as file_handle:
-        if frontmatter is not None:
-            print(toml.dumps(frontmatter).rstrip(), file=file_handle)
-            print(FRONTMATTER_SEPERATOR_CHAR * FRONTMATTER_SEPERATOR_MIN_LENGTH, file=file_handle)
-        print(content.rstrip(), file=file_handle)
+    if frontmatter is not None:
+        separator = FRONTMATTER_SEPERATOR_CHAR * FRONTMATTER_SEPERATOR_MIN_LENGTH
+        contents = frontmatter_to_string(frontmatter) + '\n' + separator + '\n' + content.rstrip()
+    else:
+        contents = content.rstrip()
+    write_file(contents, path)
+
+
+def is_file_content(path: str, contents: str) -> bool:
+    if not file_exist(path):
+        return False
+    with open(path, 'r', encoding='utf-8') as input_file:
+        return input_file.read() == contents
 
 
-def write_file(contents: str, path: str) -> str:
+def write_file(contents: str, path: str, make_folder: bool = True) -> bool:
+    '''Returns False if the file already had the contents and wasn't written.'''
+    # files end with a newline
+    data = contents + '\n'
+    # don't rewrite unchanged files, this keeps watchers and syncing tools quiet
+    if is_file_content(path, data):
+        LOG.debug(f'{path} is unchanged')
+        return False
     LOG.debug(f'Writing {path}')
-    directory = os.path.dirname(path)
-    os.makedirs(directory, exist_ok=True)
+    if make_folder:
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
     with open(path, 'w', encoding='utf-8') as file_handle:
-        print(contents, file=file_handle)
+        file_handle.write(data)
+    return True
+
+
+def write_output_file(contents: str, path: str, make_folder: bool = True):
+    '''Write a build output, an unchanged output is touched so the build sees it as up to date.'''
+    if not write_file(contents, path, make_folder):
+        os.utime(path)
 
 
 def touch_file(path: str):
@@ -148,20 +218,28 @@ def touch_file(path: str):
         write_file('', path)
 
 
-re_subscript = re.compile(r'\[([^\]]+)\]\{\.subscript\}')
-re_superscript = re.compile(r'\[([^\]]+)\]\{\.superscript\}')
+# [text]{.subscript} and [text]{.superscript}
+re_script = re.compile(r'\[([^\]]+)\]\{\.(subscript|superscript)\}')
+script_html = {'subscript': 'sub', 'superscript': 'sup'}
 
-def math_to_html(content: str, regex, html: str) -> str:
+def math_to_html(content: str) -> str:
     def replce_math(match):
         thing = match.group(1)
+        html = script_html[match.group(2)]
         return '<{}>{}</{}>'.format(html, thing, html)
-    return regex.sub(replce_math, content)
+    return re_script.sub(replce_math, content)
 
-def run_markdown(contents: str):
-    cc = contents
-    cc = math_to_html(cc, re_subscript, 'sub')
-    cc = math_to_html(cc, re_superscript, 'sup')
-    body = markdown.markdown(cc, extensions=['extra', 'def_list', 'codehilite'])
+# created once, setting up the extensions is costly
+MARKDOWN = markdown.Markdown(extensions=MARKDOWN_EXTENSIONS)
+
+@functools.lru_cache(maxsize=512)
+def run_markdown(contents: str, use_cmark: bool = False):
+    cc = math_to_html(contents)
+    if use_cmark:
+        # unsafe means raw html is kept, like markdown does
+        body = cmarkgfm.markdown_to_html_with_extensions(cc, options=cmarkgfm.cmark.Options.CMARK_OPT_UNSAFE, extensions=CMARK_EXTENSIONS)
+    else:
+        body = MARKDOWN.reset().convert(cc)
     body = body.replace('<aside markdown="1"', '<aside')
     return body
 
@@ -171,32 +249,40 @@ def change_extension(file: str, extension: str):
     return base + "." + extension
 
 
+pretty_table = str.maketrans({'à': '&agrave;', 'ï': '&iuml;', 'ø': '&oslash;', 'æ': '&aelig;'})
+
 def pretty(text):
     '''Use nicer HTML entities and special characters.'''
     text = text.replace(" -- ", "&#8202;&mdash;&#8202;")
-    text = text.replace("à", "&agrave;")
-    text = text.replace("ï", "&iuml;")
-    text = text.replace("ø", "&oslash;")
-    text = text.replace("æ", "&aelig;")
-    return text
+    return text.translate(pretty_table)
 
 
-def is_all_up_to_date(input_files: typing.List[str], output: str) -> bool:
+def get_newest_mtime(input_files: typing.Iterable[str]) -> float:
     sourcemod = 0
     for path in input_files:
         sourcemod = max(sourcemod, os.path.getmtime(path))
+    return sourcemod
 
-    destmod = 0
-    if os.path.exists(output):
-        destmod = max(destmod, os.path.getmtime(output))
 
+def is_newer_than(output: str, sourcemod: float) -> bool:
+    try:
+        destmod = os.path.getmtime(output)
+    except OSError:
+        # missing
+        return False
     return sourcemod < destmod
 
 
+def is_all_up_to_date(input_files: typing.List[str], output: str) -> bool:
+    return is_newer_than(output, get_newest_mtime(input_files))
+
+
+# created once and reused for all pages
+RENDERER = pystache.renderer.Renderer(missing_tags='strict')
+
 def pystache_render(filename, template, data):
-    renderer = pystache.renderer.Renderer(missing_tags='strict')
     try:
-        return renderer.render(template, data)
+        return RENDERER.render(template, data)
     except pystache.context.KeyNotFoundError as e:
         LOG.debug(f'{filename}: {e}')
         return ''
@@ -220,6 +306,8 @@ def book_path_in_folder(folder: str) -> str:
     return os.path.join(folder, BOOK_FILE)
 
 
+# the book files are cached since they are looked up for every page, Book.save clears the cache
+@functools.lru_cache(maxsize=None)
 def get_book_file(folder: str) -> typing.Optional[str]:
     book = book_path_in_folder(folder)
     if file_exist(book):
@@ -227,6 +315,7 @@ def get_book_file(folder: str) -> typing.Optional[str]:
     return None
 
 
+@functools.lru_cache(maxsize=None)
 def find_book_file(folder: str) -> typing.Optional[str]:
     for f in iterate_parent_folders(folder):
         book = get_book_file(f)
@@ -257,38 +346,51 @@ def get_toml(toml_data: typing.Any, key: str, missing: str) -> str:
     else:
         return missing
 
+# template files don't change while running so only read them once
+@functools.lru_cache(maxsize=None)
+def read_template_file(path: str) -> str:
+    return read_file(path)
+
 def copy_file_to_dist(dest, name):
     source = os.path.join(get_template_root(), name)
-    content = read_file(source)
-    write_file(content, dest)
+    content = read_template_file(source)
+    write_output_file(content, dest)
 
 def copy_default_html_files(style_css: str):
     copy_file_to_dist(style_css, 'style.css')
 
 
+# pages in the same folder link to the same style, index and toc so cache on the folder
+@functools.lru_cache(maxsize=None)
+def relative_to_folder(source_folder: str, dst: str) -> str:
+    return os.path.relpath(dst, source_folder)
+
+
 def make_relative(src: str, dst: str) -> str:
-    source_folder = os.path.dirname(src)
-    rel = os.path.relpath(dst, source_folder)
-    return rel
+    return relative_to_folder(os.path.dirname(src), dst)
 
 
 # ![alt text](url)
 re_image = re.compile(r'!\[([^\]]*)\]\(([^)]+)\)')
 re_image_alt = 1
 re_image_url = 2
+# same as re_image but only captures the url, so findall returns strings
+re_image_only_url = re.compile(r'!\[[^\]]*\]\(([^)]+)\)')
 
-def list_images_in_markdown(md: str) -> typing.Iterable[str]:
-    for match in re_image.finditer(md):
-        yield match.group(re_image_url)
+def list_images_in_markdown(md: str) -> typing.List[str]:
+    return re_image_only_url.findall(md)
 
 
 def replace_image_in_markdown(md: str, path: str, replacements: typing.Dict[str, str]) -> str:
+    if len(replacements) == 0:
+        return md
+    new_urls = {url: make_relative(path, replacement) for url, replacement in replacements.items()}
     def replace_image_with_replacement(match):
         orig = match.group(0)
         alt_text = match.group(re_image_alt)
         orig_url = match.group(re_image_url)
-        if orig_url in replacements:
-            new_url = make_relative(path, replacements[orig_url])
+        if orig_url in new_urls:
+            new_url = new_urls[orig_url]
             new_image = '![{}]({})'.format(alt_text, new_url)
             LOG.debug(f'replacing image {orig} -> {new_image}')
             return new_image
@@ -304,7 +406,88 @@ def replace_image_in_markdown(md: str, path: str, replacements: typing.Dict[str,
 
 class Templates:
     def __init__(self, folder: str, ext: str):
-        self.template = read_file(os.path.join(folder, 'template.' + ext))
+        self.template_path = os.path.join(folder, 'template.' + ext)
+        self.template = read_template_file(self.template_path)
+        # parsed once instead of once per page
+        self.parsed = pystache.parse(self.template)
+
+
+def hash_content(contents: str) -> str:
+    return hashlib.blake2b(contents.encode('utf-8'), digest_size=16).hexdigest()
+
+
+class BuildCache:
+    def __init__(self, file_path: str, use_cmark: bool):
+        self.file_path = file_path
+        self.folder = os.path.dirname(file_path)
+        self.use_cmark = use_cmark
+        # invalidate everything if the markdown generation changes
+        if use_cmark:
+            self.key = f'{BUILD_CACHE_VERSION} cmarkgfm {importlib.metadata.version("cmarkgfm")} {" ".join(CMARK_EXTENSIONS)}'
+        else:
+            self.key = f'{BUILD_CACHE_VERSION} {markdown.__version__} {" ".join(MARKDOWN_EXTENSIONS)}'
+        self.loaded = {}
+        self.bodies = {}
+        # pages written by the last and this build, relative to the book
+        self.loaded_outputs = []
+        self.outputs = []
+        # true if the last build generated the markdown differently
+        self.invalidated = False
+
+    def get_body(self, source: str, contents: str) -> typing.Optional[str]:
+        '''The html from the last build if the markdown is unchanged, otherwise render it and call set_body.'''
+        name = os.path.relpath(source, self.folder)
+        entry = self.loaded.get(name)
+        if entry is None or entry[0] != hash_content(contents):
+            return None
+        self.bodies[name] = entry
+        return entry[1]
+
+    def set_body(self, source: str, contents: str, html: str):
+        self.bodies[os.path.relpath(source, self.folder)] = [hash_content(contents), html]
+
+    def remove_stale_outputs(self, pages: typing.List['Page']):
+        '''Remove the pages the last build wrote that are no longer in the book, files not written by a build are kept.'''
+        self.outputs = sorted(os.path.relpath(page.target, self.folder) for page in pages)
+        current = set(self.outputs)
+        for name in self.loaded_outputs:
+            path = os.path.join(self.folder, name)
+            if name not in current and file_exist(path):
+                LOG.info(f'Removing stale {path}')
+                os.remove(path)
+
+    def from_json(self, data):
+        # the outputs don't depend on how the markdown is generated
+        self.loaded_outputs = get_json(data, CACHE_JSON_OUTPUTS, [])
+        if get_json(data, CACHE_JSON_KEY, '') == self.key:
+            self.loaded = get_json(data, CACHE_JSON_BODIES, {})
+        else:
+            self.invalidated = True
+
+    def to_json(self):
+        data = {}
+        data[CACHE_JSON_KEY] = self.key
+        data[CACHE_JSON_BODIES] = self.bodies
+        data[CACHE_JSON_OUTPUTS] = self.outputs
+        return data
+
+    def save(self):
+        # up to date pages weren't rendered, keep their entries
+        for name, entry in self.loaded.items():
+            if name not in self.bodies and file_exist(os.path.join(self.folder, name)):
+                self.bodies[name] = entry
+        if self.bodies != self.loaded or self.outputs != self.loaded_outputs:
+            write_file(json.dumps(self.to_json()), self.file_path)
+
+    @staticmethod
+    def load(file_path: str, use_cmark: bool) -> 'BuildCache':
+        cache = BuildCache(file_path, use_cmark)
+        if file_exist(file_path):
+            try:
+                cache.from_json(json_loads(read_file(file_path)))
+            except json.JSONDecodeError as e:
+                LOG.warning(f'{file_path}: ignoring invalid cache: {e}')
+        return cache
 
 
 class Stat:
@@ -317,18 +500,24 @@ class Stat:
         word_count = len(contents.split(None))
         if is_chapter:
             self.num_chapters += 1
-            if word_count < 50:
+            if word_count < 2000:
                 self.empty_chapters += 1
-                LOG.info(f"    {name}")
-            elif word_count < 2000:
-                self.empty_chapters += 1
-                LOG.info(f"{Fore.YELLOW}-{Style.RESET_ALL} {name} ({word_count} words)")
             else:
                 self.total_words += word_count
-                LOG.info(f"{Fore.GREEN}✓{Style.RESET_ALL} {name} ({word_count} words)")
-        else:
+        # skip formatting the status when it isn't shown
+        if LOG.isEnabledFor(logging.INFO):
+            LOG.info(Stat.status(name, word_count, is_chapter))
+
+    @staticmethod
+    def status(name: str, word_count: int, is_chapter: bool) -> str:
+        if not is_chapter:
             # Section header chapters aren't counted like regular chapters.
-            LOG.info(f"{Fore.GREEN}•{Style.RESET_ALL} {name} ({word_count} words)")
+            return f"{Fore.GREEN}•{Style.RESET_ALL} {name} ({word_count} words)"
+        if word_count < 50:
+            return f"    {name}"
+        if word_count < 2000:
+            return f"{Fore.YELLOW}-{Style.RESET_ALL} {name} ({word_count} words)"
+        return f"{Fore.GREEN}✓{Style.RESET_ALL} {name} ({word_count} words)"
 
     def print_estimate(self):
         valid_chapters = self.num_chapters - self.empty_chapters
@@ -346,15 +535,30 @@ class GlobalData:
 
 
 class GeneratedData:
-    def __init__(self, glob: GlobalData, extension: str, book_title: str, root: str, toc: str, style_css: str, index_html: str, toc_html: str):
+    def __init__(self, glob: GlobalData, extension: str, book_title: str, root: str, toc_pages: typing.List['Page'], index_source: str, index_target: str, style_css: str, index_html: str, toc_html: str, dependencies_mtime: float, pages_mtime: float, force: bool):
         self.glob = glob
         self.extension = extension
         self.book_title = book_title
         self.root = root
-        self.toc = toc
+        # the toc is only generated if the toc page needs to be written
+        self.toc_pages = toc_pages
+        self.index_source = index_source
+        self.index_target = index_target
+        self.generated_toc: typing.Optional[str] = None
         self.style_css = style_css
         self.index_html = index_html
         self.toc_html = toc_html
+        # newest of the files that every page depends on, if any of these change all pages are regenerated
+        self.dependencies_mtime = dependencies_mtime
+        # newest page source
+        self.pages_mtime = pages_mtime
+        self.force = force
+
+    @property
+    def toc(self) -> str:
+        if self.generated_toc is None:
+            self.generated_toc = generate_toc(self.toc_pages, self.extension, self.index_source, self.index_target)
+        return self.generated_toc
 
 
 class GuessedData:
@@ -390,57 +594,97 @@ def drop_p_tag(html: str) -> str:
         return s
 
 
+# titles that markdown would only wrap in a paragraph
+re_plain_title = re.compile(r"[A-Za-z][A-Za-z0-9 ,.:;!?'()]*")
+
+def title_to_html(title: str) -> str:
+    if re_plain_title.fullmatch(title) is not None:
+        return title
+    return drop_p_tag(run_markdown(title))
+
+
 class Page:
-    def __init__(self, chapter: str, source: str, target: str, html_body: str, title: str):
+    def __init__(self, chapter: str, source: str, target: str, html_body: typing.Optional[str], title: str, content: str = '', cache: typing.Optional[BuildCache] = None):
         self.source = source
         self.target = target
-        self.title = drop_p_tag(run_markdown(title))
-        self.html_body = html_body
+        self.title = title_to_html(title)
+        # if the body is None the markdown content is rendered when needed
+        self.body = html_body
+        self.content = content
+        self.cache = cache
+        # images referenced in the markdown, so the build doesn't have to read the file again
+        self.images = list_images_in_markdown(content)
         self.chapter = chapter
         self.next_page = None
         self.prev_page = None
         self.parent = None
         self.children = []
+        # parent, grandparent... up to the book index, set in post_generation
+        self.ancestors = []
+        # modification time of the source, 0 if there is no source file
+        self.mtime = 0
 
     @staticmethod
-    def from_file(stat: Stat, chapter: str, source: str, target: str, is_chapter: bool) -> 'Page':
+    def from_file(stat: Stat, cache: BuildCache, chapter: str, source: str, target: str, is_chapter: bool) -> 'Page':
         frontmatter, content = read_frontmatter_file(source)
         guess = GuessedData(source)
         general = ParsedFrontmatter(frontmatter, guess)
-        html_body = run_markdown(content)
         title = general.title
         stat.update(content, chapter, is_chapter)
-        return Page(chapter, source, target, html_body, title)
+        page = Page(chapter, source, target, None, title, content, cache)
+        page.mtime = os.path.getmtime(source)
+        return page
+
+    def get_markdown_to_render(self) -> typing.Optional[str]:
+        '''The markdown content if the body isn't rendered or cached, the body is rendered by render_page.'''
+        if self.body is None:
+            self.body = self.cache.get_body(self.source, self.content)
+        return self.content if self.body is None else None
+
+    def set_rendered_body(self, body: str):
+        self.cache.set_body(self.source, self.content, body)
+        self.body = body
+        self.content = ''
+
+    def is_toc(self) -> bool:
+        return self.body == TOC_HTML_BODY
 
     @staticmethod
     def post_generation(pages: typing.List['Page']):
-        last_page = None
-        for page in pages:
-            page.prev_page = last_page
-            if last_page is not None:
-                last_page.next_page = page
-            last_page = page
+        for prev_page, page in zip(pages, pages[1:]):
+            page.prev_page = prev_page
+            prev_page.next_page = page
 
-    def write(self, templates: Templates, gen: GeneratedData):
+        # pages are added before their children so the parent ancestors are already done
+        for page in pages:
+            page.ancestors = [] if page.parent is None else [page.parent] + page.parent.ancestors
+
+    def get_newest_dependency(self, gen: GeneratedData) -> float:
+        newest = gen.dependencies_mtime
+        if self.is_toc():
+            # toc lists the title of every page
+            newest = max(newest, gen.pages_mtime)
+        # title of self and parents (and book) are part of the generated page
+        return max([newest, self.mtime] + [p.mtime for p in self.ancestors])
+
+    def is_up_to_date(self, gen: GeneratedData) -> bool:
+        if gen.force:
+            return False
+        return is_newer_than(self.target, self.get_newest_dependency(gen))
+
+    def generate_data(self, gen: GeneratedData) -> typing.Dict[str, typing.Any]:
         data = {}
-        template = templates.template
 
-        titles = [{"title": self.title}]
-        section_headers = []
-
-        p = self.parent
-        while p is not None:
-            if p.parent is not None:
-                titles.append({"title": p.title})
-                section_href = make_relative(self.target, p.target)
-                section_headers.append({'title': p.title, 'href': section_href})
-            p = p.parent
-        section_headers.reverse()
+        # the book index isn't a section
+        sections = [p for p in self.ancestors if p.parent is not None]
+        titles = [{"title": self.title}] + [{"title": p.title} for p in sections]
+        section_headers = [{'title': p.title, 'href': make_relative(self.target, p.target)} for p in reversed(sections)]
 
         prev_page = '' if self.prev_page is None else make_relative(self.target, self.prev_page.target)
         next_page = '' if self.next_page is None else make_relative(self.target, self.next_page.target)
 
-        data['body'] = gen.toc if self.html_body == TOC_HTML_BODY else self.html_body
+        # None if the markdown is rendered by render_page
+        data['body'] = gen.toc if self.is_toc() else self.body
         data['no_title_page'] = self.title != "Colophon"
         data['title'] = self.title
         data['titles'] = titles
@@ -453,41 +697,77 @@ class Page:
         data['style_css'] = make_relative(self.target, gen.style_css)
         data['book_title'] = gen.book_title
         data['copyright'] = gen.glob.copyright
+        return data
 
-        generated = pystache_render(self.source, template, data)
-        write_file(generated, self.target)
-
-    def generate_html_list(self, extension: str, indent: str, file: str):
-        html = indent + '<li><a href="{}">{}</a>'.format(make_relative(file, self.target), self.title)
+    def generate_html_list(self, extension: str, indent: str, file: str, html: typing.List[str]):
+        html.append(indent + '<li><a href="{}">{}</a>'.format(make_relative(file, self.target), self.title))
         if len(self.children) > 0:
-            html += '\n' + indent + '    <ul>\n'
+            html.append('\n' + indent + '    <ul>\n')
             for c in self.children:
-                html += c.generate_html_list(extension, indent + '    ', file) + '\n'
-            html += indent + '    </ul>\n' + indent
-        html += '</li>'
-        return html
-
-
-def strip_empty_start(lines: typing.Iterable[str]) -> typing.Iterable[str]:
-    empty = True
-    for li in lines:
-        if len(li.strip()) == 0:
-            if empty:
-                pass
-            else:
-                yield li
+                c.generate_html_list(extension, indent + '    ', file, html)
+                html.append('\n')
+            html.append(indent + '    </ul>\n' + indent)
+        html.append('</li>')
+
+
+# (source, target, template, data, markdown_content, use_cmark), only plain data so it can be sent to a worker process
+# markdown_content is None if the body is already in data
+RenderTask = typing.Tuple[str, str, pystache.parsed.ParsedTemplate, typing.Dict[str, typing.Any], typing.Optional[str], bool]
+
+def render_page(task: RenderTask) -> typing.Optional[str]:
+    '''Returns the rendered markdown body, if any, so it can be cached.'''
+    source, target, template, data, markdown_content, use_cmark = task
+    body = None
+    if markdown_content is not None:
+        body = run_markdown(markdown_content, use_cmark)
+        data['body'] = body
+    generated = pystache_render(source, template, data)
+    # folders are created by write_pages
+    write_output_file(generated, target, make_folder=False)
+    return body
+
+
+def write_pages(pages: typing.List[Page], templates: Templates, gen: GeneratedData, cache: BuildCache, jobs: typing.Optional[int]):
+    outdated = []
+    for page in pages:
+        if page.is_up_to_date(gen):
+            LOG.debug(f'{page.target} is up to date')
         else:
-            empty = False
-            yield li
+            outdated.append(page)
+
+    # create each output folder once instead of once per page
+    for folder in {os.path.dirname(page.target) for page in outdated}:
+        os.makedirs(folder, exist_ok=True)
+
+    tasks = []
+    for page in outdated:
+        # markdown is rendered in the workers too, it's most of the build time
+        markdown_content = page.get_markdown_to_render()
+        tasks.append((page.source, page.target, templates.parsed, page.generate_data(gen), markdown_content, cache.use_cmark))
+    # all workers are started up front, so don't start more than there are pages
+    workers = min(jobs or os.cpu_count() or 1, len(tasks))
+    if workers <= 1:
+        bodies = [render_page(task) for task in tasks]
+    else:
+        # send the tasks in batches, a few per worker, instead of one round trip per page
+        chunksize = max(1, len(tasks) // (workers * 4))
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            bodies = list(executor.map(render_page, tasks, chunksize=chunksize))
+
+    for page, body in zip(outdated, bodies):
+        if body is not None:
+            page.set_rendered_body(body)
 
 
-def strip_empty(lines: typing.List[str]) -> typing.List[str]:
-    cleared = lines
-    cleared.reverse()
-    cleared = list(strip_empty_start(cleared)) # end
-    cleared.reverse()
-    cleared = list(strip_empty_start(cleared)) # start
-    return cleared
+# (start, end) so that lines[start:end] is lines without the leading and trailing empty lines
+def strip_empty_bounds(lines: typing.List[str]) -> typing.Tuple[int, int]:
+    start = 0
+    end = len(lines)
+    while start < end and len(lines[start].strip()) == 0:
+        start += 1
+    while end > start and len(lines[end-1].strip()) == 0:
+        end -= 1
+    return (start, end)
 
 
 def update_frontmatter(chapter_path: str, guess_arg: typing.Optional[GuessedData], extra_content: typing.Optional[str]):
@@ -507,10 +787,16 @@ def update_frontmatter(chapter_path: str, guess_arg: typing.Optional[GuessedData
         if fmo != frontmatter_to_string(frontmatter):
             write_chapter = True
     if write_chapter or extra_content is not None:
-        cc = strip_empty(content.splitlines())
+        lines = content.splitlines()
+        start, end = strip_empty_bounds(lines)
+        cc = lines[start:end]
         if extra_content is not None:
-            cc = cc + [''] + strip_empty(extra_content.splitlines())
-        cc = strip_empty(cc)
+            extra = extra_content.splitlines()
+            extra_start, extra_end = strip_empty_bounds(extra)
+            if extra_start < extra_end:
+                if len(cc) > 0:
+                    cc.append('')
+                cc.extend(extra[extra_start:extra_end])
         write_frontmatter_file(chapter_path, frontmatter, '\n'.join(cc))
 
 
@@ -522,13 +808,11 @@ def update_frontmatter_index(chapter_path: str):
     update_frontmatter(chapter_path, None, '')
 
 
-def create_page(stat: Stat, chapter: str, source_folder: str, target_folder: str, ext: str) -> Page:
+def create_page(stat: Stat, cache: BuildCache, chapter: str, source_folder: str, target_folder: str, ext: str) -> Page:
     source = os.path.join(source_folder, chapter)
     target = os.path.join(target_folder, change_extension(chapter, ext) if file_exist(source) else chapter)
-    book_index_file = os.path.join(os.path.dirname(find_book_file(source_folder)), CHAPTER_INDEX)
-    is_index = source == book_index_file
     is_chapter = chapter == CHAPTER_INDEX
-    return Page.from_file(stat, chapter, source, target, is_chapter)
+    return Page.from_file(stat, cache, chapter, source, target, is_chapter)
 
 
 class Chapter:
@@ -543,6 +827,12 @@ class Chapter:
         else:
             self.chapters.append(chap)
 
+    def add_chapters(self, chaps: typing.List[str], add_at_start: bool = False):
+        if add_at_start:
+            self.chapters[0:0] = chaps
+        else:
+            self.chapters.extend(chaps)
+
     def from_json(self, data):
         self.chapters = data[CHAPTER_JSON_CHAPTERS]
 
@@ -557,36 +847,39 @@ class Chapter:
     @staticmethod
     def load(file_path: str) -> 'Chapter':
         book = Chapter(file_path)
-        data = json.loads(read_file(file_path))
+        data = json_loads(read_file(file_path))
         book.from_json(data)
         return book
 
-    def generate_pages(self, target_folder: str, ext: str, stat: Stat, pages: typing.List[Page]) -> Page:
+    def generate_pages(self, target_folder: str, ext: str, stat: Stat, cache: BuildCache, pages: typing.List[Page]) -> Page:
+        entries = list_folder(self.source_folder)
+
         chapter_index_file = os.path.join(self.source_folder, CHAPTER_INDEX)
-        if not file_exist(chapter_index_file):
+        if CHAPTER_INDEX not in entries or not entries[CHAPTER_INDEX].is_file():
             LOG.error(f'{chapter_index_file}: file not found')
 
-        root_page = create_page(stat, CHAPTER_INDEX, self.source_folder, target_folder, ext)
+        root_page = create_page(stat, cache, CHAPTER_INDEX, self.source_folder, target_folder, ext)
         pages.append(root_page)
 
-        book_index_file = os.path.join(os.path.dirname(find_book_file(self.source_folder)), CHAPTER_INDEX)
-
         for chapter in self.chapters:
             source = os.path.join(self.source_folder, chapter)
             is_special_toc = chapter == TOC_INDEX
-            target = os.path.join(target_folder, change_extension(chapter, ext) if file_exist(source) or is_special_toc else chapter)
-            if file_exist(source) or is_special_toc:
-                is_index = source == book_index_file
+            # chapters in a sub folder aren't in entries
+            entry = entries.get(chapter)
+            is_file = entry.is_file() if entry is not None else file_exist(source)
+            is_folder = entry.is_dir() if entry is not None else folder_exist(source)
+            target = os.path.join(target_folder, change_extension(chapter, ext) if is_file or is_special_toc else chapter)
+            if is_file or is_special_toc:
                 is_chapter = chapter == CHAPTER_INDEX
-                child_page = Page.from_file(stat, chapter, source, target, is_chapter) if not is_special_toc else Page(chapter, source, target, TOC_HTML_BODY, 'Table of Contents')
+                child_page = Page.from_file(stat, cache, chapter, source, target, is_chapter) if not is_special_toc else Page(chapter, source, target, TOC_HTML_BODY, 'Table of Contents')
                 pages.append(child_page)
                 root_page.children.append(child_page)
                 child_page.parent = root_page
-            elif folder_exist(source):
+            elif is_folder:
                 section_file = os.path.join(source, CHAPTER_FILE)
                 if file_exist(section_file):
                     section = Chapter.load(section_file)
-                    child_page = section.generate_pages(target, ext, stat, pages)
+                    child_page = section.generate_pages(target, ext, stat, cache, pages)
 
                     root_page.children.append(child_page)
                     child_page.parent = root_page
@@ -597,6 +890,16 @@ class Chapter:
 
         return root_page
 
+    def iterate_chapter_files(self) -> typing.Iterator[str]:
+        yield self.file_path
+        for chapter in self.chapters:
+            source = os.path.join(self.source_folder, chapter)
+            section_file = os.path.join(source, CHAPTER_FILE)
+            if folder_exist(source) and file_exist(section_file):
+                section = Chapter.load(section_file)
+                for p in section.iterate_chapter_files():
+                    yield p
+
     def iterate_markdown_files(self) -> typing.Iterator[str]:
         yield os.path.join(self.source_folder, CHAPTER_INDEX)
         for chapter in self.chapters:
@@ -614,21 +917,19 @@ class Chapter:
         index_file = os.path.join(self.source_folder, CHAPTER_INDEX)
         if is_book:
             update_frontmatter_index(index_file)
-
-            fm, _ = read_frontmatter_file(index_file)
-            guess = GuessedData(index_file)
-            data = ParsedFrontmatter(fm, guess)
         else:
             update_frontmatter_chapter(index_file)
 
-        for chapter in self.chapters:
-            path = os.path.join(self.source_folder, chapter)
-            update_frontmatter_chapter(path)
+        # every chapter is a separate file so overlap the reads and writes
+        paths = [os.path.join(self.source_folder, chapter) for chapter in self.chapters]
+        with concurrent.futures.ThreadPoolExecutor(max_workers=16) as executor:
+            # list() to raise any exception from the threads
+            list(executor.map(update_frontmatter_chapter, paths))
 
 
 
 def generate_toc(pages: typing.List[Page], extension: str, index_source: str, target: str) -> str:
-    html = ''
+    html = []
 
     # add only pages after toc, or if toc is missing then add all
     children = []
@@ -636,14 +937,14 @@ def generate_toc(pages: typing.List[Page], extension: str, index_source: str, ta
     for c in pages:
         if found_toc:
             children.append(c)
-        if c.html_body == TOC_HTML_BODY:
+        if c.is_toc():
             found_toc = True
     children = pages if len(children) == 0 and not found_toc else children
 
     for page in children:
         if page.source != index_source:
-            html = html + page.generate_html_list(extension, '  ', target)
-    return html
+            page.generate_html_list(extension, '  ', target, html)
+    return ''.join(html)
 
 
 class Book(Chapter):
@@ -667,22 +968,17 @@ class Book(Chapter):
 
     def save(self):
         write_file(json.dumps(self.to_json(), indent=4), self.file_path)
+        # this might be a new book
+        get_book_file.cache_clear()
+        find_book_file.cache_clear()
 
     @staticmethod
     def load(file_path: str) -> 'Book':
         book = Book(file_path)
-        data = json.loads(read_file(file_path))
+        data = json_loads(read_file(file_path))
         book.from_json(data)
         return book
 
-    def iterate_markdown_files(self) -> typing.Iterator[str]:
-        chapter_path = os.path.join(self.source_folder, CHAPTER_INDEX)
-        frontmatter, _ = read_frontmatter_file(chapter_path)
-        if frontmatter is not None:
-            data = ParsedFrontmatter(frontmatter, GuessedData(chapter_path))
-        for p in super().iterate_markdown_files():
-            yield p
-
 
 ###################################################################################################
 ###################################################################################################
@@ -879,29 +1175,28 @@ def handle_add(args):
         book.save()
 
 
+name_from_title_table = str.maketrans({' ': '_', '/': '-', '.': None, '*': None, ':': None, ',': None, '(': None, ')': None, '?': None})
+
+@functools.lru_cache(maxsize=None)
 def name_from_title(title: str) -> str:
-    t = title
-    t = t.lower()
-    t = t.replace(' ', '_')
-    t = t.replace('.', '')
-    t = t.replace('*', '')
-    t = t.replace(':', '')
-    t = t.replace(',', '')
-    t = t.replace('(', '')
-    t = t.replace(')', '')
-    t = t.replace('?', '')
-    t = t.replace('/', '-')
-    return t
+    return title.lower().translate(name_from_title_table)
 
 
-def new_page(book: Chapter, title: str, content: str, add_at_start: bool = False) -> bool:
+def new_page_file(book: Chapter, title: str, content: str) -> typing.Optional[str]:
     chapter = name_from_title(title) + '.md'
     chapter_path = os.path.join(book.source_folder, chapter)
     if file_exist(chapter_path):
         LOG.info(f'{chapter} already exists, so ignoring...')
+        return None
+    update_frontmatter_chapter(chapter_path, GuessedData(source=chapter_path, title=title), content=content)
+    return chapter
+
+
+def new_page(book: Chapter, title: str, content: str, add_at_start: bool = False) -> bool:
+    chapter = new_page_file(book, title, content)
+    if chapter is None:
         return False
     book.add_chapter(chapter, add_at_start)
-    update_frontmatter_chapter(chapter_path, GuessedData(source=chapter_path, title=title), content=content)
     return True
 
 
@@ -910,6 +1205,7 @@ def handle_new_page(args):
     if book is None:
         return
 
+    changed = False
     for title in args.pages:
         if new_page(book ,title, ''):
             changed = True
@@ -918,56 +1214,70 @@ def handle_new_page(args):
         book.save()
 
 
-def line_contains(line: str, on: typing.Optional[str]) -> bool:
-    if on is None:
-        return True
-    return on.lower() in line.lower()
+re_markdown_header_tag = re.compile(r'\{#[^}]+\}')
+# start of every line where is_single_hash_header is true
+re_markdown_header_lines = re.compile(r'^(?=#[^#\n]* )', re.MULTILINE)
 
 
-re_markdown_header = re.compile(r'^#[^#]* ')
-re_markdown_header_tag = re.compile(r'\{#[^}]+\}')
+def is_single_hash_header(line: str) -> bool:
+    '''Starts with a # followed by a space before any other #, same as the regex '^#[^#]* ' but faster.'''
+    if not line.startswith('#'):
+        return False
+    space = line.find(' ', 1)
+    return space != -1 and line.find('#', 1, space) == -1
+
+def count_lines(content: str) -> int:
+    return content.count('\n') + 1
+
 
-def markdown_extract_pages_from_lines(file: typing.Iterable[str], on: typing.Optional[str]=None) -> typing.Iterable[typing.Tuple[str, typing.List[str]]]:
+# (title, content) for each page
+def markdown_extract_pages_from_lines(file: typing.Iterable[str], on: typing.Optional[str]=None) -> typing.Iterable[typing.Tuple[str, str]]:
     header = None
     lines = []
+    # first and last non empty line, tracked while adding so the page doesn't need to be stripped
+    first = None
+    last = 0
+    on_lower = on.lower() if on is not None else None
     for line_space in file:
         line = line_space.rstrip()
-        if line.startswith('# ') and line_contains(line, on):
-            if header is None:
-                lines = strip_empty(lines)
-                if len(lines) > 0:
-                    yield ('', lines)
-            else:
-                stripped = strip_empty(lines)
-                if len(stripped) != 0:
-                    yield (header, stripped)
+        if line.startswith('# ') and (on_lower is None or on_lower in line.lower()):
+            if first is not None:
+                yield ('' if header is None else header, '\n'.join(lines[first:last+1]))
             lines = []
+            first = None
             header = re_markdown_header_tag.sub('', line[1:].strip()).strip()
         else:
-            if re_markdown_header.match(line) is not None and on is None:
+            if on is None and is_single_hash_header(line):
                 line = line[1:]
+            if len(line) > 0:
+                if first is None:
+                    first = len(lines)
+                last = len(lines)
             lines.append(line)
-    if header is not None:
-        stripped = strip_empty(lines)
-        if len(stripped) != 0:
-            yield (header, stripped)
+    if header is not None and first is not None:
+        yield (header, '\n'.join(lines[first:last+1]))
 
 
-def markdown_extract_pages_from_file(path: str) -> typing.Iterable[typing.Tuple[str, typing.List[str]]]:
+def markdown_extract_pages_from_file(path: str) -> typing.Iterable[typing.Tuple[str, str]]:
     with open(path) as file:
-        lines = file.readlines()
-        return markdown_extract_pages_from_lines(lines)
+        yield from markdown_extract_pages_from_lines(file)
 
 
-def update_images(from_path: str, to_path: str, md: str) -> str:
+# entries is list_folder of the from_path folder, pass it when updating several pages from the same file
+def update_images(from_path: str, to_path: str, md: str, entries: typing.Optional[typing.Dict[str, os.DirEntry]] = None) -> str:
     from_folder = os.path.dirname(from_path)
+    debug = LOG.isEnabledFor(logging.DEBUG)
     replacements = {}
     for image in list_images_in_markdown(md):
         image_path = os.path.join(from_folder, image)
-        if file_exist(image_path):
+        # images in other folders aren't in entries
+        entry = entries.get(image) if entries is not None else None
+        exists = entry.is_file() if entry is not None else file_exist(image_path)
+        if exists:
             # new_image = make_relative(to_path, image_path)
             replacements[image] = image_path
-            LOG.debug(f'replacing {image} with {image_path}')
+            if debug:
+                LOG.debug(f'replacing {image} with {image_path}')
         else:
             LOG.warning(f'WARNING: ignoring missing image {image_path}')
 
@@ -991,9 +1301,9 @@ def handle_split_markdown(args):
 
         if args.print:
             for data in pages:
-                title, lines = data
+                title, page_content = data
                 file_name = name_from_title(title) + '.md' if len(title) > 0 else '<unchanged>'
-                LOG.info(f'{title} ({len(lines)}) -> {file_name}')
+                LOG.info(f'{title} ({count_lines(page_content)}) -> {file_name}')
             return
         else:
             if len(pages)==0:
@@ -1003,7 +1313,7 @@ def handle_split_markdown(args):
         remaining_content = ''
         first_title, first_content = pages[0]
         if len(first_title.strip()) == 0:
-            remaining_content = '\n'.join(first_content)
+            remaining_content = first_content
             pages = pages[1:]
 
         if len(pages) == 0:
@@ -1012,16 +1322,14 @@ def handle_split_markdown(args):
 
         if args_file == CHAPTER_INDEX:
             write_frontmatter_file(from_file_path, frontmatter, remaining_content)
-            if not book_has_only_toc:
-                # since we add to the start, we need to go in reverse
-                pages.reverse()
-            for data in pages:
-                title, lines = data
-                new_page(book, title, '\n'.join(lines), add_at_start=not book_has_only_toc)
+            new_chapters = [new_page_file(book, title, page_content) for title, page_content in pages]
+            book.add_chapters([chapter for chapter in new_chapters if chapter is not None], add_at_start=not book_has_only_toc)
 
             book.save()
         else:
-            if args_file not in book.chapters:
+            try:
+                chapter_index = book.chapters.index(args_file)
+            except ValueError:
                 LOG.error('This is not a page in a chapter!')
                 return
 
@@ -1030,7 +1338,7 @@ def handle_split_markdown(args):
             dir_path = os.path.join(book.source_folder, dir_name)
 
             # replace page with chapter in book
-            book.chapters = [dir_name if chap==args_file else chap for chap in book.chapters]
+            book.chapters[chapter_index] = dir_name
 
             # remove original page
             os.unlink(original_page_file)
@@ -1045,13 +1353,15 @@ def handle_split_markdown(args):
             # create chapter index with title and remaining content
             chapter_path = os.path.join(dir_path, CHAPTER_INDEX)
             chapter_title = ParsedFrontmatter(frontmatter, GuessedData(chapter_path)).title
-            update_frontmatter_chapter(chapter_path, GuessedData(chapter_path, chapter_title), update_images(from_file_path, chapter_path, remaining_content))
+            # list the folder once for all the split pages
+            from_entries = list_folder(os.path.dirname(from_file_path))
+            update_frontmatter_chapter(chapter_path, GuessedData(chapter_path, chapter_title), update_images(from_file_path, chapter_path, remaining_content, from_entries))
 
             # add split pages in sub chapter
             for data in pages:
-                title, lines = data
+                title, page_content = data
                 page_file = os.path.join(chapter.source_folder, name_from_title(title) + '.md')
-                new_page(chapter, title, update_images(from_file_path, page_file, '\n'.join(lines)))
+                new_page(chapter, title, update_images(from_file_path, page_file, page_content, from_entries))
 
             chapter.save()
             book.save()
@@ -1067,10 +1377,9 @@ def handle_indent_markdown(args):
         from_file_path = os.path.join(book.source_folder, args_file)
         frontmatter, content = read_frontmatter_file(from_file_path)
 
-        lines = content.splitlines()
-        if any(line.startswith('# ') for line in lines):
-            newlines = ['#' + line if re_markdown_header.match(line) is not None else line for line in lines]
-            write_frontmatter_file(from_file_path, frontmatter, '\n'.join(newlines))
+        if content.startswith('# ') or '\n# ' in content:
+            indented = re_markdown_header_lines.sub('#', content)
+            write_frontmatter_file(from_file_path, frontmatter, indented)
 
 
 def handle_import_markdown(args):
@@ -1083,8 +1392,8 @@ def handle_import_markdown(args):
 
     if args.print:
         for data in pages:
-            title, lines = data
-            LOG.info('{} ({})'.format(title, len(lines)))
+            title, page_content = data
+            LOG.info('{} ({})'.format(title, count_lines(page_content)))
     else:
         if len(pages) > 1:
             LOG.error('Unable to create a book from {}'.format(path))
@@ -1096,12 +1405,12 @@ def handle_import_markdown(args):
             return
 
         index_file = os.path.join(root, CHAPTER_INDEX)
-        title, lines = pages[0]
+        title, page_content = pages[0]
         frontmatter = {}
         guess = GuessedData(index_file, title)
         data = ParsedFrontmatter({}, guess)
         data.generate(frontmatter)
-        write_frontmatter_file(index_file, frontmatter, '\n'.join(lines))
+        write_frontmatter_file(index_file, frontmatter, page_content)
 
         path = book_path_in_folder(root)
         book = Book(path)
@@ -1112,7 +1421,23 @@ def handle_import_markdown(args):
 
 
 
-def handle_build(_):
+def copy_image(image: typing.Tuple[str, str]):
+    source_path, target_path = image
+    LOG.debug(f'Copying {os.path.basename(target_path)}')
+    # copyfile uses sendfile/copy_file_range when the os supports it
+    shutil.copyfile(source_path, target_path)
+
+
+def copy_images(images: typing.Iterable[typing.Tuple[str, str]], force: bool):
+    outdated = [(source, target) for source, target in images if force or not is_all_up_to_date([source], target)]
+    for folder in {os.path.dirname(target) for _, target in outdated}:
+        os.makedirs(folder, exist_ok=True)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+        # list() to raise any exception from the threads
+        list(executor.map(copy_image, outdated))
+
+
+def handle_build(args):
     root = os.getcwd()
     ext = 'html'
 
@@ -1127,41 +1452,53 @@ def handle_build(_):
     html = os.path.join(book_folder, 'html')
     index_target = change_extension(os.path.join(html, CHAPTER_INDEX), ext)
     stat = Stat()
+    use_cmark = args.cmark
+    if use_cmark and cmarkgfm is None:
+        LOG.warning('cmarkgfm is not installed, using markdown')
+        use_cmark = False
+    cache = BuildCache.load(os.path.join(book_folder, BUILD_CACHE_FILE), use_cmark)
     templates = Templates(get_template_root(), ext)
 
     pages = []
     glob = book.generate_globals()
-    root_page = book.generate_pages(html, ext, stat, pages)
+    root_page = book.generate_pages(html, ext, stat, cache, pages)
     gen = GeneratedData(
         glob,
         ext,
         book_title=root_page.title,
         root=book_folder,
-        toc=generate_toc([root_page] + root_page.children, ext, index_source, index_target),
+        toc_pages=[root_page] + root_page.children,
+        index_source=index_source,
+        index_target=index_target,
         style_css=os.path.join(html, 'style.css'),
         index_html=os.path.join(html, 'index.html'),
-        toc_html=os.path.join(html, 'toc.html')
+        toc_html=os.path.join(html, 'toc.html'),
+        dependencies_mtime=get_newest_mtime(list(book.iterate_chapter_files()) + [templates.template_path]),
+        pages_mtime=max(page.mtime for page in pages),
+        force=args.force or cache.invalidated
         )
     Page.post_generation(pages)
 
-    copy_default_html_files(gen.style_css)
-    for page in pages:
-        page.write(templates, gen)
+    if gen.force or not is_all_up_to_date([os.path.join(get_template_root(), 'style.css')], gen.style_css):
+        copy_default_html_files(gen.style_css)
+    write_pages(pages, templates, gen, cache, args.jobs)
+    cache.remove_stale_outputs(pages)
 
-    for md in book.iterate_markdown_files():
-        _, content = read_frontmatter_file(md)
-        markdown_folder = os.path.dirname(md)
+    images = set()
+    for page in pages:
+        markdown_folder = os.path.dirname(page.source)
         relative = make_relative(book.file_path, markdown_folder)
-        for image in list_images_in_markdown(content):
+        for image in page.images:
             url = urllib.parse.urlparse(image)
             if url.scheme == '':
                 # image_name = os.path.basename(url.path)
                 image_name = url.path
                 source_path = os.path.normpath(os.path.join(markdown_folder, image_name))
-                target_path = os.path.normpath(os.path.realpath(os.path.join(html, relative, image_name)))
-                os.makedirs(os.path.dirname(target_path), exist_ok=True)
-                LOG.debug(f'Copying {os.path.basename(target_path)}')
-                shutil.copyfile(source_path, target_path)
+                target_path = os.path.normpath(os.path.join(html, relative, image_name))
+                images.add((source_path, target_path))
+    copy_images(images, gen.force)
+
+    cache.save()
 
     # generate
     stat.print_estimate()
@@ -1190,11 +1527,29 @@ def handle_list_images(_):
     book = Book.load(path)
 
     for md in book.iterate_markdown_files():
-        _, content = read_frontmatter_file(md)
-        for image in list_images_in_markdown(content):
+        for image in list_images_in_markdown(read_markdown_body(md)):
             LOG.info(image)
 
 
+def make_images_local(md: str, content: str, images: typing.Dict[str, str]) -> str:
+    '''Point external images to a file next to the markdown, the url to file to download is added to images.'''
+    markdown_folder = os.path.dirname(md)
+    def replace_external_image(match):
+        image = match.group(re_image_url)
+        url = urllib.parse.urlparse(image)
+        if url.scheme == '':
+            return match.group(0)
+        image_name = os.path.basename(url.path)
+        target_path = os.path.join(markdown_folder, image_name)
+        if file_exist(target_path):
+            LOG.error(f'{md}: Image {image_name} already exists')
+        # a url used in several files is downloaded once, next to the first file
+        if image not in images:
+            images[image] = target_path
+        return '![{}]({})'.format(match.group(re_image_alt), make_relative(md, images[image]))
+    return re_image.sub(replace_external_image, content)
+
+
 def handle_make_local(_):
     root = os.getcwd()
     path = find_book_file(root)
@@ -1206,28 +1561,22 @@ def handle_make_local(_):
 
     images = {}
 
-    markdown_files = list(book.iterate_markdown_files())
-
-    for md in markdown_files:
-        _, content = read_frontmatter_file(md)
-        markdown_folder = os.path.dirname(md)
-        for image in list_images_in_markdown(content):
-            url = urllib.parse.urlparse(image)
-            if url.scheme != '':
-                image_name = os.path.basename(url.path)
-                target_path = os.path.join(markdown_folder, image_name)
-                if file_exist(target_path):
-                    LOG.error(f'{md}: Image {image_name} already exists')
-                images[image] = target_path
-
-    for md in markdown_files:
+    for md in book.iterate_markdown_files():
         frontmatter, content = read_frontmatter_file(md)
-        content = replace_image_in_markdown(content, md, images)
-        write_frontmatter_file(md, frontmatter, content)
+        local_content = make_images_local(md, content, images)
+        if local_content != content:
+            write_frontmatter_file(md, frontmatter, local_content)
 
+    # urls with the same name in the same folder share a file, only download the first one
+    # so two threads never write the same file
+    downloads = {}
     for source, dest in images.items():
-        if not file_exist(dest):
-            urllib.request.urlretrieve(source, dest)
+        if dest not in downloads and not file_exist(dest):
+            downloads[dest] = source
+    # downloading is waiting on the network, so download all at the same time
+    with concurrent.futures.ThreadPoolExecutor(max_workers=16) as executor:
+        # list() to raise any exception from the threads
+        list(executor.map(lambda download: urllib.request.urlretrieve(download[1], download[0]), downloads.items()))
 
     LOG.info(f'{len(images)} replacements made')
 
@@ -1236,6 +1585,16 @@ def handle_make_local(_):
 ###################################################################################################
 
 
+def positive_int(text: str) -> int:
+    try:
+        value = int(text)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'{text} is not a number')
+    if value < 1:
+        raise argparse.ArgumentTypeError(f'{text} must be 1 or more')
+    return value
+
+
 def main():
     parser = argparse.ArgumentParser(description='Create or write a book')
     sub_parsers = parser.add_subparsers(dest='command_name', title='Commands', help='', metavar='<command>')
@@ -1282,6 +1641,9 @@ def main():
     sub.set_defaults(func=handle_indent_markdown)
 
     sub = sub_parsers.add_parser('build', help='Generate html')
+    sub.add_argument('--force', action='store_true', help='regenerate all pages, even the ones that are up to date')
+    sub.add_argument('--cmark', action='store_true', help='use the faster cmarkgfm parser if installed, definition lists and code highlighting are not supported')
+    sub.add_argument('--jobs', type=positive_int, default=None, help='number of processes used to generate pages, defaults to the number of cpus')
     sub.set_defaults(func=handle_build)
 
     sub = sub_parsers.add_parser('make_local', help='Download external image and update markdown')